@@ -1,24 +1,45 @@
 import asyncio
-import json
+import base64
+import io
 import os
+import random
+import signal
 import sys
+import threading
 from typing import Optional, Any
 from contextlib import AsyncExitStack
+from urllib.parse import quote
 
 from mcp import ClientSession
 from mcp.client.sse import sse_client
 
 import boto3
+import httpx
+import orjson
+from botocore.auth import SigV4Auth
+from botocore.awsrequest import AWSRequest
+from botocore.credentials import RefreshableCredentials
+from botocore.eventstream import EventStreamBuffer
 from botocore.exceptions import ClientError
 from dotenv import load_dotenv
 
+from fastpath import json_default
+
 load_dotenv()  # load environment variables from .env
 
+# Retry throttled, failed (5xx) and dropped Bedrock requests like botocore's standard retry mode
+BEDROCK_MAX_ATTEMPTS = 3
+BEDROCK_BACKOFF_BASE = 0.5  # seconds
+BEDROCK_BACKOFF_MAX = 20.0  # seconds
+
+
 class MCPClient:
     def __init__(self):
         # Initialize session and client objects
         self.session: Optional[ClientSession] = None
         self.exit_stack = AsyncExitStack()
+        # Tool catalog fetched once per connection and reused across queries
+        self._available_tools: list[dict[str, Any]] = []
         
         # Initialize AWS Bedrock client for Claude
         aws_access_key = os.environ.get("AWS_ACCESS_KEY_ID")
@@ -31,9 +52,9 @@ class MCPClient:
             print("Please set AWS_ACCESS_KEY_ID and AWS_SECRET_ACCESS_KEY.")
         
         try:
-            # Create Bedrock client with session token if provided
+            # Create AWS session with session token if provided; its credentials
+            # are used to SigV4-sign the async requests sent to Bedrock
             client_kwargs = {
-                'service_name': 'bedrock-runtime',
                 'region_name': aws_region,
                 'aws_access_key_id': aws_access_key,
                 'aws_secret_access_key': aws_secret_key,
@@ -42,7 +63,7 @@ class MCPClient:
             if aws_session_token:
                 client_kwargs['aws_session_token'] = aws_session_token
                 
-            self.bedrock_client = boto3.client(**client_kwargs)
+            self.aws_session = boto3.Session(**client_kwargs)
             
             # Test the connection to detect authentication issues early
             # self.bedrock_client.list_foundation_models(maxResults=1)
@@ -59,10 +80,20 @@ class MCPClient:
             print("3. If using temporary credentials, ensure AWS_SESSION_TOKEN is set correctly")
             print("4. Verify you have access to the Claude 3.7 Sonnet model in your AWS region")
             
-            # Still create the client, but we'll check bedrock availability before each call
-            self.bedrock_client = boto3.client(**client_kwargs)
+            # Still create the session, but we'll check bedrock availability before each call
+            self.aws_session = boto3.Session(**client_kwargs)
         
+        self.aws_region = aws_region
         self.claude_model_id = "us.anthropic.claude-3-7-sonnet-20250219-v1:0"
+        # Resolve credentials and the endpoint once instead of on every Bedrock call
+        self.aws_credentials = self.aws_session.get_credentials()
+        self.bedrock_stream_url = (
+            f"https://bedrock-runtime.{aws_region}.amazonaws.com"
+            f"/model/{quote(self.claude_model_id, safe='')}/invoke-with-response-stream"
+        )
+        self._signer: Optional[SigV4Auth] = None
+        # Single async HTTP client reused for every Bedrock call so requests don't block the event loop
+        self.http_client = httpx.AsyncClient(http2=True, timeout=httpx.Timeout(300.0, connect=10.0))
         self.bedrock_available = True  # Will be set to False if authentication fails during usage
 
     async def connect_to_sse_server(self, server_url: str):
@@ -82,13 +113,21 @@ class MCPClient:
             # List available tools to verify connection
             print("Initialized SSE client...")
             print("Listing tools...")
-            response = await self.session.list_tools()
-            tools = response.tools
-            print("\nConnected to server with tools:", [tool.name for tool in tools])
+            await self.refresh_tools()
+            print("\nConnected to server with tools:", [tool["name"] for tool in self._available_tools])
         except Exception as e:
             print(f"Error connecting to server: {str(e)}")
             raise
 
+    async def refresh_tools(self):
+        """Re-fetch the server's tool catalog used for Claude requests"""
+        response = await self.session.list_tools()
+        self._available_tools = [{
+            "name": tool.name,
+            "description": tool.description,
+            "input_schema": tool.inputSchema
+        } for tool in response.tools]
+
     async def cleanup(self):
         """Properly clean up the session and streams"""
         try:
@@ -96,11 +135,18 @@ class MCPClient:
                 await self._session_context.__aexit__(None, None, None)
             if hasattr(self, '_streams_context') and self._streams_context:
                 await self._streams_context.__aexit__(None, None, None)
+            await self.http_client.aclose()
         except Exception as e:
             print(f"Error during cleanup: {str(e)}")
 
-    def _invoke_bedrock_claude(self, messages, tools=None):
-        """Invoke Claude 3.7 Sonnet via AWS Bedrock"""
+    async def _invoke_bedrock_claude(self, messages, tools=None, on_tool_use=None, on_text=None):
+        """Invoke Claude 3.7 Sonnet via AWS Bedrock, streaming the response.
+
+        If given, on_tool_use is called with each tool_use block as soon as it has been
+        fully streamed, so the tool call can start while Claude is still responding, and
+        on_text is called with each piece of response text as it arrives, with a newline
+        after each text block.
+        """
         if not self.bedrock_available:
             raise Exception("AWS Bedrock authentication failed. Please check your credentials.")
             
@@ -113,45 +159,156 @@ class MCPClient:
         if tools:
             request_body["tools"] = tools
         
-        try:
-            response = self.bedrock_client.invoke_model(
-                modelId=self.claude_model_id,
-                body=json.dumps(request_body)
-            )
-            
-            response_body = json.loads(response.get('body').read().decode('utf-8'))
-            return response_body
+        if self.aws_credentials is None:
+            self.bedrock_available = False
+            raise Exception("AWS credentials not found. Please check your credentials.")
+        
+        # Encode in one C-level pass; MCP model objects in messages fall back to json_default
+        body = orjson.dumps(request_body, default=json_default)
+        
+        for attempt in range(BEDROCK_MAX_ATTEMPTS):
+            is_last_attempt = attempt == BEDROCK_MAX_ATTEMPTS - 1
+            if attempt:
+                # Exponential backoff with full jitter
+                await asyncio.sleep(random.uniform(0, min(BEDROCK_BACKOFF_MAX, BEDROCK_BACKOFF_BASE * 2 ** attempt)))
             
-        except ClientError as e:
-            error_code = e.response.get('Error', {}).get('Code', 'Unknown')
-            error_message = e.response.get('Error', {}).get('Message', str(e))
+            # Sign every attempt with SigV4 so the signature timestamp is fresh, and send it
+            # without blocking the event loop
+            aws_request = AWSRequest(
+                method="POST",
+                url=self.bedrock_stream_url,
+                data=body,
+                headers={"Content-Type": "application/json", "X-Amzn-Bedrock-Accept": "application/json"}
+            )
+            (await self._get_signer()).add_auth(aws_request)
+            prepped = aws_request.prepare()
             
-            if error_code in ['UnrecognizedClientException', 'InvalidSignatureException', 
-                              'ExpiredTokenException', 'AccessDeniedException']:
-                self.bedrock_available = False
-                print(f"AWS authentication error: {error_message}")
-                print("Please check your AWS credentials and permissions.")
+            stream_started = False
+            try:
+                async with self.http_client.stream(
+                    "POST", prepped.url, headers=dict(prepped.headers), content=body
+                ) as response:
+                    if response.is_success:
+                        stream_started = True
+                        return await self._read_bedrock_stream(response, on_tool_use, on_text)
+                    
+                    await response.aread()
+            except httpx.TransportError as e:
+                # Once the stream has started, output and tool calls may already have been
+                # dispatched, so only connection failures before that are retried
+                if stream_started or is_last_attempt:
+                    raise Exception(f"AWS Bedrock request failed: {str(e)}")
+                continue
+            except httpx.HTTPError as e:
+                raise Exception(f"AWS Bedrock request failed: {str(e)}")
             
-            raise Exception(f"AWS Bedrock error ({error_code}): {error_message}")
-
-    def _serialize_for_json(self, obj: Any) -> Any:
-        """Helper method to make objects JSON serializable"""
-        if hasattr(obj, '__dict__'):
-            return obj.__dict__
-        elif hasattr(obj, 'model_dump'):
-            return obj.model_dump()
-        elif hasattr(obj, 'dict'):
-            return obj.dict()
-        elif isinstance(obj, (list, tuple)):
-            return [self._serialize_for_json(item) for item in obj]
-        elif isinstance(obj, dict):
-            return {k: self._serialize_for_json(v) for k, v in obj.items()}
-        return str(obj)
-
-    async def process_query(self, query: str) -> str:
-        """Process a query using Claude and available tools"""
+            if not is_last_attempt and (response.status_code == 429 or response.status_code >= 500):
+                continue
+            break
+        
+        error_code = response.headers.get('x-amzn-ErrorType', 'Unknown').split(':')[0]
+        try:
+            error_body = response.json()
+            error_message = error_body.get('message', error_body.get('Message', response.text))
+        except ValueError:
+            error_message = response.text
+        
+        self._raise_bedrock_error(error_code, error_message)
+
+    async def _get_signer(self) -> SigV4Auth:
+        """Return the SigV4 signer for Bedrock, rebuilt only when the credentials change"""
+        credentials = self.aws_credentials
+        if isinstance(credentials, RefreshableCredentials) and credentials.refresh_needed():
+            # Refreshing calls out to STS/SSO/IMDS with blocking boto code, so run it off the event loop
+            loop = asyncio.get_running_loop()
+            frozen_credentials = await loop.run_in_executor(None, credentials.get_frozen_credentials)
+        else:
+            frozen_credentials = credentials.get_frozen_credentials()
+        if self._signer is None or self._signer.credentials != frozen_credentials:
+            self._signer = SigV4Auth(frozen_credentials, "bedrock", self.aws_region)
+        return self._signer
+
+    async def _read_bedrock_stream(self, response, on_tool_use=None, on_text=None):
+        """Rebuild Claude's response from a Bedrock event stream"""
+        message = {"content": []}
+        blocks = {}
+        tool_input_json = {}
+        event_buffer = EventStreamBuffer()
+        
+        async for data in response.aiter_bytes():
+            event_buffer.add_data(data)
+            for event in event_buffer:
+                message_type = event.headers.get(':message-type')
+                if message_type == 'error':
+                    # Error frames carry their details in headers with an empty payload
+                    self._raise_bedrock_error(
+                        event.headers.get(':error-code', 'Unknown'),
+                        event.headers.get(':error-message', '')
+                    )
+                payload = orjson.loads(event.payload)
+                if message_type == 'exception':
+                    self._raise_bedrock_error(
+                        event.headers.get(':exception-type', 'Unknown'),
+                        payload.get('message', payload.get('Message', str(payload)))
+                    )
+                
+                chunk = orjson.loads(base64.b64decode(payload["bytes"]))
+                chunk_type = chunk.get("type")
+                
+                if chunk_type == "message_start":
+                    message.update(chunk["message"])
+                elif chunk_type == "content_block_start":
+                    blocks[chunk["index"]] = chunk["content_block"]
+                    tool_input_json[chunk["index"]] = []
+                elif chunk_type == "content_block_delta":
+                    delta = chunk["delta"]
+                    if delta.get("type") == "text_delta":
+                        blocks[chunk["index"]]["text"] += delta.get("text", "")
+                        if on_text:
+                            on_text(delta.get("text", ""))
+                    elif delta.get("type") == "input_json_delta":
+                        tool_input_json[chunk["index"]].append(delta.get("partial_json", ""))
+                elif chunk_type == "content_block_stop":
+                    block = blocks[chunk["index"]]
+                    if block.get("type") == "text" and on_text:
+                        on_text("\n")
+                    elif block.get("type") == "tool_use":
+                        input_json = "".join(tool_input_json[chunk["index"]])
+                        block["input"] = orjson.loads(input_json) if input_json else {}
+                        if on_tool_use:
+                            on_tool_use(block)
+                elif chunk_type == "message_delta":
+                    message.update(chunk.get("delta", {}))
+        
+        message["content"] = [blocks[index] for index in sorted(blocks)]
+        return message
+
+    def _raise_bedrock_error(self, error_code, error_message):
+        """Raise a Bedrock error, flagging Bedrock as unavailable on authentication failures"""
+        if error_code in ['UnrecognizedClientException', 'InvalidSignatureException', 
+                          'ExpiredTokenException', 'AccessDeniedException']:
+            self.bedrock_available = False
+            print(f"AWS authentication error: {error_message}")
+            print("Please check your AWS credentials and permissions.")
+        
+        raise Exception(f"AWS Bedrock error ({error_code}): {error_message}")
+
+    async def process_query(self, query: str, on_text=None) -> str:
+        """Process a query using Claude and available tools.
+
+        The full output is returned; if given, on_text is also called with each piece of
+        it as soon as it is available, so callers can display the response while it streams.
+        """
+        output = io.StringIO()
+
+        def write_output(text):
+            output.write(text)
+            if on_text:
+                on_text(text)
+
         if not self.session:
-            return "Not connected to server. Please connect first."
+            write_output("Not connected to server. Please connect first.")
+            return output.getvalue()
             
         messages = [
             {
@@ -159,21 +316,38 @@ class MCPClient:
                 "content": query
             }
         ]
+        tool_uses = []
+        tool_tasks = []
+
+        def start_tool_call(content):
+            # Start each tool call as soon as its block is streamed, while Claude keeps responding
+            tool_name = content.get("name")
+            tool_args = content.get("input", {})
+            tool_id = content.get("id", f"tool_{len(tool_uses)}")
+            tool_tasks.append(asyncio.create_task(self.session.call_tool(tool_name, tool_args)))
+
+            # Serialize the args once: the bytes are shown in the output and embedded
+            # as-is in the request body instead of being re-encoded on every Bedrock call
+            args_json = orjson.dumps(tool_args)
+            tool_uses.append({
+                "type": "tool_use", 
+                "name": tool_name, 
+                "input": orjson.Fragment(args_json),
+                "id": tool_id
+            })
+
+            # Display the tool call in the output
+            write_output(f"[Calling tool {tool_name} with args {args_json.decode()}]\n")
 
         try:
-            # Get available tools
-            response = await self.session.list_tools()
-            available_tools = [{
-                "name": tool.name,
-                "description": tool.description,
-                "input_schema": tool.inputSchema
-            } for tool in response.tools]
+            # Reuse the tool catalog fetched when connecting
+            available_tools = self._available_tools
 
             # Initial Claude API call via Bedrock
             print("Sending request to Claude via AWS Bedrock...")
             
             # First try without tools to see if it's a simple conversational query
-            bedrock_response = self._invoke_bedrock_claude(
+            bedrock_response = await self._invoke_bedrock_claude(
                 messages=messages,
                 tools=None  # Don't include tools on the first try
             )
@@ -191,75 +365,108 @@ class MCPClient:
             
             if needs_tools and available_tools:
                 print("Response suggests tools might be needed. Retrying with tools...")
-                # Retry with tools
-                bedrock_response = self._invoke_bedrock_claude(
+                # Retry with tools, streaming the response text and tool calls into the output
+                await self._invoke_bedrock_claude(
                     messages=messages,
-                    tools=available_tools
+                    tools=available_tools,
+                    on_tool_use=start_tool_call,
+                    on_text=write_output
                 )
-            
-            # Process response and handle tool calls
-            tool_results = []
-            final_text = []
+            else:
+                for content in bedrock_response.get("content", []):
+                    if content.get("type") == 'text':
+                        write_output(content.get("text", "") + "\n")
 
-            for content in bedrock_response.get("content", []):
+            # Keep answering tool calls until Claude responds without requesting any
+            while tool_uses:
+                # Wait for the tool calls started while the response was streaming
+                results = await asyncio.gather(*tool_tasks)
+
+                # Add all tool calls to our conversation in a single assistant message - include the required "id" field
+                messages.append({
+                    "role": "assistant",
+                    "content": list(tool_uses)
+                })
                 
-                if content.get("type") == 'text':
-                    final_text.append(content.get("text", ""))
-                elif content.get("type") == 'tool_use':
-                    tool_name = content.get("name")
-                    tool_args = content.get("input", {})
-                    tool_id = content.get("id", f"tool_{len(tool_results)}")
-                    
-                    # Execute tool call
-                    print(f"Calling tool: {tool_name}")
-                    result = await self.session.call_tool(tool_name, tool_args)
-                    
-                    # Get the result content as a string to ensure it's serializable
-                    result_content = str(result.content)
-                    
-                    # Display the tool call in the output
-                    safe_args = json.dumps(tool_args, ensure_ascii=False)
-                    final_text.append(f"[Calling tool {tool_name} with args {safe_args}]")
-
-                    # Add the tool result to our conversation - include the required "id" field
-                    messages.append({
-                        "role": "assistant",
-                        "content": [
-                            {
-                                "type": "tool_use", 
-                                "name": tool_name, 
-                                "input": tool_args,
-                                "id": tool_id
-                            }
-                        ]
-                    })
-                    
-                    # Pass the tool result as a string to ensure it's serializable - include the required "tool_use_id" field
-                    messages.append({
-                        "role": "user",
-                        "content": [
-                            {
-                                "type": "tool_result", 
-                                "content": result_content,
-                                "tool_use_id": tool_id
-                            }
-                        ]
-                    })
-
-                    # Get next response from Claude via Bedrock
-                    print("Getting Claude's response to the tool result...")
-                    bedrock_response = self._invoke_bedrock_claude(messages=messages, tools=available_tools)
-                    
-                    # Add the final response to our output
-                    for cont in bedrock_response.get("content", []):
-                        if cont.get("type") == "text":
-                            final_text.append(cont.get("text", ""))
+                # Pass every tool result as a string in a single user message - include the required "tool_use_id" field
+                messages.append({
+                    "role": "user",
+                    "content": [
+                        {
+                            "type": "tool_result", 
+                            "content": self._tool_result_content(result),
+                            "tool_use_id": tool_use["id"],
+                            "is_error": bool(getattr(result, "isError", False))
+                        }
+                        for tool_use, result in zip(tool_uses, results)
+                    ]
+                })
+                tool_uses.clear()
+                tool_tasks.clear()
+
+                # Get next response from Claude via Bedrock
+                print("Getting Claude's response to the tool results...")
+                await self._invoke_bedrock_claude(
+                    messages=messages,
+                    tools=available_tools,
+                    on_tool_use=start_tool_call,
+                    on_text=write_output
+                )
 
-            return "\n".join(final_text)
+            return output.getvalue()
         except Exception as e:
             import traceback
             trace = traceback.format_exc()
-            return f"Error processing query: {str(e)}\n\n{trace}"
+            write_output(f"Error processing query: {str(e)}\n\n{trace}")
+            return output.getvalue()
+        finally:
+            # Don't leave tool calls running if the query failed part-way
+            for task in tool_tasks:
+                task.cancel()
+
+    def _tool_result_content(self, result) -> str:
+        """Render an MCP tool result as compact text for Claude"""
+        # Prefer the structured result when the server sends one; it is the same data as the text blocks
+        structured = getattr(result, "structuredContent", None)
+        if structured is not None:
+            return orjson.dumps(structured, default=json_default).decode()
+        return "\n".join(
+            block.text if getattr(block, "type", None) == "text"
+            else orjson.dumps(block, default=json_default).decode()
+            for block in result.content
+        )
+
+    async def _read_line(self) -> str:
+        """Read a line from stdin without blocking the event loop"""
+        loop = asyncio.get_running_loop()
+        line_future = loop.create_future()
+
+        def resolve(set_outcome, value):
+            if not line_future.done():
+                set_outcome(value)
+
+        def read_line():
+            line = sys.stdin.readline()
+            loop.call_soon_threadsafe(resolve, line_future.set_result, line)
+
+        # A daemon thread, unlike the default executor, does not keep the process alive
+        # at exit while it is still blocked in readline
+        threading.Thread(target=read_line, daemon=True).start()
+
+        # asyncio.run turns Ctrl+C into a cancellation of the main task; at the prompt,
+        # raise KeyboardInterrupt instead so the chat loop can exit cleanly
+        sigint_handler = signal.getsignal(signal.SIGINT)
+        try:
+            loop.add_signal_handler(
+                signal.SIGINT, resolve, line_future.set_exception, KeyboardInterrupt()
+            )
+        except (NotImplementedError, RuntimeError):
+            return await line_future  # no signal handlers on this loop (e.g. Windows)
+        try:
+            return await line_future
+        finally:
+            loop.remove_signal_handler(signal.SIGINT)
+            signal.signal(signal.SIGINT, sigint_handler)
 
     async def chat_loop(self):
         """Run an interactive chat loop"""
@@ -268,14 +475,20 @@ class MCPClient:
         
         while True:
             try:
-                query = input("\nQuery: ").strip()
+                # Read stdin off the event loop so it keeps running while the user types
+                print("\nQuery: ", end="", flush=True)
+                line = await self._read_line()
+                if not line:  # EOF
+                    break
+                query = line.strip()
                 
                 if query.lower() in ('quit', 'exit'):
                     break
                     
                 print("Processing your query...")
-                response = await self.process_query(query)
-                print("\n" + response)
+                print()
+                # Print the response as it streams in rather than after it completes
+                await self.process_query(query, on_text=lambda text: print(text, end="", flush=True))
                     
             except KeyboardInterrupt:
                 print("\nDetected Ctrl+C. Exiting...")
@@ -0,0 +1,49 @@
+# Hot helpers shared by the client and the Location server. The module is plain Python
+# so it always works as-is, and is written to compile unchanged with mypyc or Cython
+# (see README) for a faster build; a compiled extension takes precedence on import.
+from typing import Any, Dict, List
+
+
+def format_location(location_data: Dict[str, Any]) -> str:
+    """Format location data into a readable string."""
+    address = location_data.get('address', {})
+    contact = location_data.get('contact', {})
+    
+    return f"""
+Location Name: {location_data.get('locationName', 'Unknown')}
+Location Code: {location_data.get('locationCode', 'Unknown')}
+Type: {location_data.get('locationType', 'Unknown')}
+SubType: {location_data.get('locationSubType', 'Unknown')}
+Operated By: {location_data.get('operatedBy', 'Unknown')}
+
+Address: {address.get('address1', 'Unknown')},
+         {address.get('city', 'Unknown')},
+         {address.get('stateProvinceRegion', 'Unknown')} {address.get('postalCode', 'Unknown')}
+Country: {address.get('country', 'Unknown')}
+Coordinates: {address.get('latitude', 'Unknown')}, {address.get('longitude', 'Unknown')}
+
+Contact: 
+  Phone: {contact.get('phone', location_data.get('contactPhone', 'Unknown'))}
+  Fax: {contact.get('fax', 'Not provided')}
+  Email: {contact.get('email', 'Not provided')}
+
+Time Zone: {location_data.get('timeZone', 'Unknown')}
+Location Active: {location_data.get('locationActive', 'Unknown')}
+Region: {location_data.get('region', 'Unknown')}
+"""
+
+
+def format_location_batch(items: List[Dict[str, Any]]) -> str:
+    """Format many locations at once, joined by separators."""
+    return "\n---\n".join(map(format_location, items))
+
+
+def json_default(obj: Any) -> Any:
+    """orjson fallback that makes objects it can't encode natively JSON serializable"""
+    if hasattr(obj, '__dict__'):
+        return obj.__dict__
+    elif hasattr(obj, 'model_dump'):
+        return obj.model_dump()
+    elif hasattr(obj, 'dict'):
+        return obj.dict()
+    return str(obj)
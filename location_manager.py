@@ -1,12 +1,22 @@
-from typing import Any, Dict, Optional
+import asyncio
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, Optional, TypedDict
 import httpx
 import os
+import signal
+import zlib
 from dotenv import load_dotenv
+from fastpath import format_location, format_location_batch
 from mcp.server.fastmcp import FastMCP
+from mcp.server.fastmcp.exceptions import ToolError
 from starlette.applications import Starlette
 from mcp.server.sse import SseServerTransport
+from starlette.datastructures import MutableHeaders
 from starlette.requests import Request
 from starlette.routing import Mount, Route
+from starlette.types import Message, Send
 from mcp.server import Server
 import uvicorn
 
@@ -20,118 +30,260 @@ mcp = FastMCP("location")
 LOCATION_API_BASE = "https://int.dev.api.coxautoinc.com/wholesale-marketplace/enablement/locations"
 BEARER_TOKEN = os.getenv("BEARER_TOKEN")
 
+# Request headers and URL prefixes are fixed for the process, so build them once
+_HEADERS = {
+    "Authorization": f"Bearer {BEARER_TOKEN}",
+    "Accept": "application/json"
+}
+_LOCATION_BY_ID_URL = f"{LOCATION_API_BASE}/id/"
+_SEARCH_BY_NAME_URL = f"{LOCATION_API_BASE}/search?name="
+_SEARCH_BY_STATE_URL = f"{LOCATION_API_BASE}/search?state="
+
+# Shared HTTP client so connections (and TLS sessions) to the Location API are reused across tool calls
+_client = httpx.AsyncClient(
+    http2=True,
+    timeout=30.0,
+    limits=httpx.Limits(max_connections=100, max_keepalive_connections=20),
+    headers=_HEADERS,
+)
+
+# Successful Location API responses keyed by URL, as (expiry, data), least recently used first
+_response_cache: OrderedDict[str, tuple[float, Dict[str, Any]]] = OrderedDict()
+_CACHE_MAX_SIZE = 1024
+_CACHE_TTL_SECONDS = 300.0
+
 
 async def make_location_request(url: str) -> Dict[str, Any] | None:
-    """Make a request to the Location API with proper error handling."""
-    headers = {
-        "Authorization": f"Bearer {BEARER_TOKEN}",
-        "Accept": "application/json"
-    }
-    async with httpx.AsyncClient() as client:
-        try:
-            response = await client.get(url, headers=headers, timeout=30.0)
-            response.raise_for_status()
-            return response.json()
-        except Exception as e:
-            print(f"Error fetching location data: {e}")
-            return None
-
-
-def format_location(location_data: Dict[str, Any]) -> str:
-    """Format location data into a readable string."""
-    address = location_data.get('address', {})
-    contact = location_data.get('contact', {})
-    
-    return f"""
-Location Name: {location_data.get('locationName', 'Unknown')}
-Location Code: {location_data.get('locationCode', 'Unknown')}
-Type: {location_data.get('locationType', 'Unknown')}
-SubType: {location_data.get('locationSubType', 'Unknown')}
-Operated By: {location_data.get('operatedBy', 'Unknown')}
-
-Address: {address.get('address1', 'Unknown')},
-         {address.get('city', 'Unknown')},
-         {address.get('stateProvinceRegion', 'Unknown')} {address.get('postalCode', 'Unknown')}
-Country: {address.get('country', 'Unknown')}
-Coordinates: {address.get('latitude', 'Unknown')}, {address.get('longitude', 'Unknown')}
-
-Contact: 
-  Phone: {contact.get('phone', location_data.get('contactPhone', 'Unknown'))}
-  Fax: {contact.get('fax', 'Not provided')}
-  Email: {contact.get('email', 'Not provided')}
-
-Time Zone: {location_data.get('timeZone', 'Unknown')}
-Location Active: {location_data.get('locationActive', 'Unknown')}
-Region: {location_data.get('region', 'Unknown')}
-"""
+    """Make a request to the Location API with proper error handling and response caching."""
+    cached = _response_cache.get(url)
+    if cached is not None:
+        expires_at, data = cached
+        if expires_at > time.monotonic():
+            _response_cache.move_to_end(url)
+            return data
+        del _response_cache[url]
+
+    try:
+        response = await _client.get(url)
+        response.raise_for_status()
+        data = response.json()
+    except Exception as e:
+        # Failures are not cached so the next call retries upstream
+        print(f"Error fetching location data: {e}")
+        return None
+
+    _response_cache[url] = (time.monotonic() + _CACHE_TTL_SECONDS, data)
+    _response_cache.move_to_end(url)
+    if len(_response_cache) > _CACHE_MAX_SIZE:
+        _response_cache.popitem(last=False)
+    return data
+
+
+# Admission control for SSE sessions: the condition guards the active-session counter
+_sse_cond = asyncio.Condition(asyncio.Lock())
+_active_sse_sessions = 0
+_max_sse_sessions = 256
+
+# Batches larger than this are formatted in a worker thread to keep the event loop free
+_FORMAT_IN_THREAD_THRESHOLD = 32
+
+
+async def format_locations(items: list[Dict[str, Any]]) -> str:
+    """Format a list of locations, off the event loop for large batches."""
+    if len(items) > _FORMAT_IN_THREAD_THRESHOLD:
+        return await asyncio.to_thread(format_location_batch, items)
+    return format_location_batch(items)
+
+
+class LocationResult(TypedDict, total=False):
+    """Result of get_location_by_id: the location as JSON, or its text summary when formatted."""
+    location: Dict[str, Any]
+    summary: str
+
+
+class LocationSearchResult(TypedDict, total=False):
+    """Result of a location search: the matching locations as JSON, or their text summary when formatted."""
+    items: list[Dict[str, Any]]
+    summary: str
 
 
 @mcp.tool()
-async def get_location_by_id(location_id: str) -> str:
+async def get_location_by_id(location_id: str, formatted: bool = False) -> LocationResult:
     """Get location information by location ID/code.
 
+    Returns an object {"location": {...}} with the location record, or
+    {"summary": "..."} with a text summary when formatted is true.
+
     Args:
         location_id: Location identifier (e.g. QIM4, ABC1)
+        formatted: Return a human-readable text summary instead of JSON
     """
-    url = f"{LOCATION_API_BASE}/id/{location_id}"
+    url = _LOCATION_BY_ID_URL + location_id
     data = await make_location_request(url)
 
     if not data:
-        return "Unable to fetch location data for this ID."
+        raise ToolError("Unable to fetch location data for this ID.")
 
-    # return format_location(data)
-    retrurn data
+    if formatted:
+        return {"summary": format_location(data)}
+    return {"location": data}
 
 
 @mcp.tool()
-async def search_locations_by_name(name: str) -> str:
+async def search_locations_by_name(name: str, formatted: bool = False) -> LocationSearchResult:
     """Search for locations by name.
 
+    Returns an object {"items": [...]} with the matching location records, or
+    {"summary": "..."} with a text summary when formatted is true.
+
     Args:
         name: Location name to search for (e.g. Manheim)
+        formatted: Return a human-readable text summary instead of JSON
     """
-    url = f"{LOCATION_API_BASE}/search?name={name}"
+    url = _SEARCH_BY_NAME_URL + name
     data = await make_location_request(url)
 
     if not data or "items" not in data:
-        return "Unable to fetch locations or no locations found."
+        raise ToolError("Unable to fetch locations or no locations found.")
 
-    if not data["items"]:
-        return f"No locations found matching '{name}'."
-
-    locations = [format_location(location) for location in data["items"]]
-    return "\n---\n".join(locations)
+    if formatted:
+        if not data["items"]:
+            return {"summary": f"No locations found matching '{name}'."}
+        return {"summary": await format_locations(data["items"])}
+    return {"items": data["items"]}
 
 
 @mcp.tool()
-async def get_locations_by_state(state: str) -> str:
+async def get_locations_by_state(state: str, formatted: bool = False) -> LocationSearchResult:
     """Get locations in a specific state.
 
+    Returns an object {"items": [...]} with the location records in the state, or
+    {"summary": "..."} with a text summary when formatted is true.
+
     Args:
         state: Two-letter state code (e.g. MS, FL, CA)
+        formatted: Return a human-readable text summary instead of JSON
     """
-    url = f"{LOCATION_API_BASE}/search?state={state}"
+    url = _SEARCH_BY_STATE_URL + state
     data = await make_location_request(url)
 
     if not data or "items" not in data:
-        return f"Unable to fetch locations for state '{state}'."
-
-    if not data["items"]:
-        return f"No locations found in state '{state}'."
-
-    locations = [format_location(location) for location in data["items"]]
-    return "\n---\n".join(locations)
-
-
-def create_starlette_app(mcp_server: Server, *, debug: bool = False) -> Starlette:
+        raise ToolError(f"Unable to fetch locations for state '{state}'.")
+
+    if formatted:
+        if not data["items"]:
+            return {"summary": f"No locations found in state '{state}'."}
+        return {"summary": await format_locations(data["items"])}
+    return {"items": data["items"]}
+
+
+async def set_max_sse_sessions(limit: int) -> None:
+    """Change how many SSE sessions may be served at once."""
+    global _max_sse_sessions
+    if limit < 1:
+        raise ValueError("SSE session limit must be at least 1")
+    async with _sse_cond:
+        _max_sse_sessions = limit
+        # Raising the limit may admit several waiting sessions
+        _sse_cond.notify_all()
+
+
+async def reload_max_sse_sessions() -> None:
+    """Re-read MAX_SSE_SESSIONS from the environment and .env and apply it."""
+    load_dotenv(override=True)
+    value = os.getenv("MAX_SSE_SESSIONS")
+    if value is None:
+        return
+    try:
+        await set_max_sse_sessions(int(value))
+    except ValueError as e:
+        print(f"Ignoring MAX_SSE_SESSIONS={value!r}: {e}")
+
+
+@asynccontextmanager
+async def sse_session_slot() -> AsyncIterator[None]:
+    """Wait for a free SSE session slot and hold it for the duration of the block."""
+    global _active_sse_sessions
+    async with _sse_cond:
+        await _sse_cond.wait_for(lambda: _active_sse_sessions < _max_sse_sessions)
+        _active_sse_sessions += 1
+    try:
+        yield
+    finally:
+        async with _sse_cond:
+            _active_sse_sessions -= 1
+            _sse_cond.notify(1)
+
+
+def sse_send(request: Request) -> Send:
+    """Wrap the ASGI send of an SSE request so events are gzipped and flushed one by one.
+
+    GZipMiddleware buffers streamed bodies inside the compressor, which would hold SSE
+    events back, so the stream is compressed here with a sync flush after every chunk.
+    """
+    send = request._send  # noqa: SLF001
+    compressor = None
+
+    async def send_event_stream(message: Message) -> None:
+        nonlocal compressor
+        if message["type"] == "http.response.start":
+            message = {**message, "headers": list(message.get("headers", []))}
+            headers = MutableHeaders(raw=message["headers"])
+            # Keep reverse proxies such as nginx from buffering the stream
+            if "x-accel-buffering" not in headers:
+                headers["X-Accel-Buffering"] = "no"
+            if (
+                "gzip" in request.headers.get("accept-encoding", "")
+                and "content-encoding" not in headers
+                and headers.get("content-type", "").startswith("text/event-stream")
+            ):
+                compressor = zlib.compressobj(wbits=31)  # gzip container
+                headers["Content-Encoding"] = "gzip"
+                headers.add_vary_header("Accept-Encoding")
+                del headers["Content-Length"]
+        elif message["type"] == "http.response.body" and compressor is not None:
+            body = compressor.compress(message.get("body", b""))
+            if message.get("more_body", False):
+                body += compressor.flush(zlib.Z_SYNC_FLUSH)
+            else:
+                body += compressor.flush()
+            message = {**message, "body": body}
+        await send(message)
+
+    return send_event_stream
+
+
+def create_starlette_app(
+    mcp_server: Server, *, debug: bool = False, max_sse_sessions: Optional[int] = None
+) -> Starlette:
     """Create a Starlette application that can serve the provided mcp server with SSE."""
     sse = SseServerTransport("/messages/")
 
+    @asynccontextmanager
+    async def lifespan(app: Starlette) -> AsyncIterator[None]:
+        if max_sse_sessions is not None:
+            await set_max_sse_sessions(max_sse_sessions)
+        # SIGHUP re-reads MAX_SSE_SESSIONS so the limit can change without a restart
+        loop = asyncio.get_running_loop()
+        try:
+            loop.add_signal_handler(
+                signal.SIGHUP, lambda: loop.create_task(reload_max_sse_sessions())
+            )
+        except (AttributeError, NotImplementedError, RuntimeError):
+            pass  # no SIGHUP or no signal support in this loop (e.g. Windows)
+        yield
+        try:
+            loop.remove_signal_handler(signal.SIGHUP)
+        except (AttributeError, NotImplementedError, RuntimeError):
+            pass
+        # Close the shared Location API client on shutdown
+        await _client.aclose()
+
     async def handle_sse(request: Request) -> None:
-        async with sse.connect_sse(
+        async with sse_session_slot(), sse.connect_sse(
                 request.scope,
                 request.receive,
-                request._send,  # noqa: SLF001
+                sse_send(request),
         ) as (read_stream, write_stream):
             await mcp_server.run(
                 read_stream,
@@ -141,6 +293,7 @@ def create_starlette_app(mcp_server: Server, *, debug: bool = False) -> Starlett
 
     return Starlette(
         debug=debug,
+        lifespan=lifespan,
         routes=[
             Route("/sse", endpoint=handle_sse),
             Mount("/messages/", app=sse.handle_post_message),
@@ -156,9 +309,14 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Run MCP SSE-based Location server')
     parser.add_argument('--host', default='0.0.0.0', help='Host to bind to')
     parser.add_argument('--port', type=int, default=8080, help='Port to listen on')
+    parser.add_argument('--max-sse-sessions', type=int,
+                        default=int(os.getenv("MAX_SSE_SESSIONS", _max_sse_sessions)),
+                        help='Maximum number of concurrent SSE sessions '
+                             '(send SIGHUP to re-read MAX_SSE_SESSIONS at runtime)')
     args = parser.parse_args()
 
     # Bind SSE request handling to MCP server
-    starlette_app = create_starlette_app(mcp_server, debug=True)
+    starlette_app = create_starlette_app(mcp_server, debug=True, max_sse_sessions=args.max_sse_sessions)
 
+    # uvicorn speaks HTTP/1.1 only; terminate HTTP/2 at a reverse proxy in front of it
     uvicorn.run(starlette_app, host=args.host, port=args.port)
\ No newline at end of file